@@ -1,8 +1,17 @@
 import os
 import io
+import re
+import json
+import time
 import base64
+import hashlib
 import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+import httplib2
 from google.oauth2 import service_account
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseDownload
 from googleapiclient.errors import HttpError
@@ -10,35 +19,214 @@ from utils import retry_with_backoff, inches_to_emu
 
 logger = logging.getLogger(__name__)
 
+# Template placeholders look like {{TOKEN}}
+PLACEHOLDER_PATTERN = re.compile(r'\{\{[^{}]+\}\}')
+
+# How long an identity stays out of rotation after an unexpected failure, in seconds
+UNHEALTHY_COOLDOWN_SECONDS = 300
+
 SCOPES = [
     'https://www.googleapis.com/auth/drive',
     'https://www.googleapis.com/auth/presentations',
     'https://www.googleapis.com/auth/spreadsheets'
 ]
 
-def get_services():
-    """Initialize Google API services"""
-    sa_path = os.environ.get("GCP_SERVICE_ACCOUNT_JSON")
-    sa_json_base64 = os.environ.get("GCP_SERVICE_ACCOUNT_JSON_BASE64")
-    
+def _load_credentials(sa_path: str = None, sa_json_base64: str = None):
+    """Load service account credentials from a key file path or base64 JSON"""
     if sa_json_base64:
         # Decode base64 JSON
         json_content = base64.b64decode(sa_json_base64).decode('utf-8')
-        creds = service_account.Credentials.from_service_account_info(
-            eval(json_content) if isinstance(eval(json_content), dict) else json.loads(json_content),
+        return service_account.Credentials.from_service_account_info(
+            json.loads(json_content),
             scopes=SCOPES
         )
-    elif sa_path:
-        creds = service_account.Credentials.from_service_account_file(sa_path, scopes=SCOPES)
-    else:
-        raise RuntimeError("Set GCP_SERVICE_ACCOUNT_JSON or GCP_SERVICE_ACCOUNT_JSON_BASE64")
+    if sa_path:
+        return service_account.Credentials.from_service_account_file(sa_path, scopes=SCOPES)
+    raise RuntimeError("Set GCP_SERVICE_ACCOUNT_JSON or GCP_SERVICE_ACCOUNT_JSON_BASE64")
+
+def _credentials_from_env() -> list:
+    """
+    Load every configured service account.
+    GCP_SERVICE_ACCOUNT_POOL / GCP_SERVICE_ACCOUNT_POOL_BASE64 hold comma-separated
+    key paths / base64 blobs; the single-account variables are used as a fallback.
+    """
+    pool_paths = [p.strip() for p in os.environ.get("GCP_SERVICE_ACCOUNT_POOL", "").split(",") if p.strip()]
+    pool_b64 = [b.strip() for b in os.environ.get("GCP_SERVICE_ACCOUNT_POOL_BASE64", "").split(",") if b.strip()]
     
-    slides_service = build('slides', 'v1', credentials=creds)
-    drive_service = build('drive', 'v3', credentials=creds)
-    sheets_service = build('sheets', 'v4', credentials=creds)
+    creds_list = [_load_credentials(sa_path=p) for p in pool_paths]
+    creds_list += [_load_credentials(sa_json_base64=b) for b in pool_b64]
     
-    logger.info("Google API services initialized")
-    return slides_service, drive_service, sheets_service
+    if not creds_list:
+        creds_list.append(_load_credentials(
+            sa_path=os.environ.get("GCP_SERVICE_ACCOUNT_JSON"),
+            sa_json_base64=os.environ.get("GCP_SERVICE_ACCOUNT_JSON_BASE64")
+        ))
+    return creds_list
+
+class _QuotaTrackingHttp(AuthorizedHttp):
+    """AuthorizedHttp that records every outgoing request against its identity"""
+    def __init__(self, identity, credentials):
+        # Bound each HTTP call so a hung socket cannot outlive the job's deadline by much
+        timeout = float(os.environ.get("GCP_HTTP_TIMEOUT", 60))
+        super().__init__(credentials, http=httplib2.Http(timeout=timeout))
+        self._identity = identity
+
+    def request(self, *args, **kwargs):
+        self._identity.record_request()
+        return super().request(*args, **kwargs)
+
+class ServiceIdentity:
+    """
+    One service account with its own credentials (token cache)
+    and per-minute quota accounting.
+    """
+    def __init__(self, credentials, quota_per_minute: int):
+        self.credentials = credentials
+        self.email = getattr(credentials, 'service_account_email', 'unknown')
+        self.quota_per_minute = quota_per_minute
+        self.active_jobs = 0
+        self.unhealthy_until = 0.0
+        self.template_access = {}
+        self._request_times = deque()
+        self._lock = threading.Lock()
+
+    def services(self) -> tuple:
+        """
+        Build fresh (slides, drive, sheets) clients for one job.
+        httplib2.Http is not thread-safe, so clients are never shared between concurrent jobs;
+        only the credentials and their token cache are.
+        """
+        return (
+            build('slides', 'v1', http=_QuotaTrackingHttp(self, self.credentials), cache_discovery=False),
+            build('drive', 'v3', http=_QuotaTrackingHttp(self, self.credentials), cache_discovery=False),
+            build('sheets', 'v4', http=_QuotaTrackingHttp(self, self.credentials), cache_discovery=False)
+        )
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.unhealthy_until
+
+    def mark_unhealthy(self, cooldown: float = UNHEALTHY_COOLDOWN_SECONDS):
+        """Keep the identity out of rotation for a cooldown, after which it is tried again"""
+        self.unhealthy_until = time.monotonic() + cooldown
+
+    def _trim(self, now: float):
+        while self._request_times and now - self._request_times[0] > 60:
+            self._request_times.popleft()
+
+    def record_request(self):
+        now = time.monotonic()
+        with self._lock:
+            self._trim(now)
+            self._request_times.append(now)
+
+    def headroom(self) -> int:
+        """Requests still available in the current one-minute window"""
+        with self._lock:
+            self._trim(time.monotonic())
+            return max(0, self.quota_per_minute - len(self._request_times))
+
+    def stats(self) -> dict:
+        return {
+            "active_jobs": self.active_jobs,
+            "healthy": self.healthy,
+            "headroom": self.headroom(),
+            "quota_per_minute": self.quota_per_minute
+        }
+
+class ServiceAccountPool:
+    """
+    Pool of service account identities used to shard Google API quota.
+    Jobs are routed by least-loaded (default) or hash routing, set via GCP_POOL_ROUTING.
+    """
+    def __init__(self, identities: list, routing: str = "least_loaded"):
+        if not identities:
+            raise RuntimeError("Service account pool is empty")
+        if routing not in ("least_loaded", "hash"):
+            raise ValueError(f"Unknown pool routing: {routing}")
+        self.identities = identities
+        self.routing = routing
+        self._lock = threading.Lock()
+
+    def _candidates(self, template_id: str = None) -> list:
+        # Skip unhealthy identities and those known to lack access to the template;
+        # unknown access counts as accessible
+        usable = [
+            i for i in self.identities
+            if i.healthy and (not template_id or i.template_access.get(template_id, True))
+        ]
+        return usable or self.identities
+
+    def acquire(self, job_id: str, template_id: str = None) -> ServiceIdentity:
+        """Assign a job to an identity and count it as active"""
+        candidates = self._candidates(template_id)
+        with self._lock:
+            identity = None
+            if self.routing == "hash":
+                digest = hashlib.sha1(job_id.encode('utf-8')).hexdigest()
+                identity = candidates[int(digest, 16) % len(candidates)]
+                if identity.headroom() == 0:
+                    # Hashed identity is out of quota, fall back to least loaded
+                    identity = None
+            if identity is None:
+                identity = min(candidates, key=lambda i: (i.active_jobs, -i.headroom()))
+            identity.active_jobs += 1
+        logger.info(f"Job {job_id} assigned to service account {identity.email}")
+        return identity
+
+    def release(self, identity: ServiceIdentity):
+        with self._lock:
+            identity.active_jobs = max(0, identity.active_jobs - 1)
+
+    @contextmanager
+    def lease(self, job_id: str, template_id: str = None):
+        identity = self.acquire(job_id, template_id)
+        try:
+            yield identity
+        finally:
+            self.release(identity)
+
+    def check_template_access(self, template_id: str) -> dict:
+        """
+        Check every identity can read the template.
+        Returns {email: True/False}, or None where access could not be determined.
+        """
+        results = {}
+        for identity in self.identities:
+            try:
+                _, drive_service, _ = identity.services()
+                drive_service.files().get(
+                    fileId=template_id,
+                    fields='id',
+                    supportsAllDrives=True
+                ).execute()
+                identity.template_access[template_id] = True
+            except HttpError as e:
+                if e.resp.status in (403, 404):
+                    logger.warning(f"Service account {identity.email} cannot access template {template_id}: {e}")
+                    identity.template_access[template_id] = False
+                else:
+                    # 429/5xx are transient: leave access unknown
+                    logger.warning(f"Could not check template access for {identity.email}: {e}")
+            except Exception as e:
+                # Revoked/disabled keys (RefreshError), timeouts, etc.: out of rotation until the cooldown ends
+                logger.error(f"Service account {identity.email} is unusable, marking unhealthy for "
+                             f"{UNHEALTHY_COOLDOWN_SECONDS}s: {e}")
+                identity.mark_unhealthy()
+            results[identity.email] = identity.template_access.get(template_id)
+        return results
+
+    def stats(self) -> list:
+        """Per-identity load and health, keyed by pool index (emails stay in the logs)"""
+        return [dict(identity.stats(), index=n) for n, identity in enumerate(self.identities)]
+
+def get_service_pool() -> ServiceAccountPool:
+    """Initialize a pool of Google API identities from the environment"""
+    quota = int(os.environ.get("GCP_QUOTA_PER_MINUTE", 60))
+    routing = os.environ.get("GCP_POOL_ROUTING", "least_loaded")
+    identities = [ServiceIdentity(creds, quota) for creds in _credentials_from_env()]
+    logger.info(f"Google API service pool initialized with {len(identities)} identities ({routing} routing)")
+    return ServiceAccountPool(identities, routing)
 
 @retry_with_backoff()
 def copy_template(drive_service, template_id: str, new_title: str) -> dict:
@@ -52,37 +240,83 @@ def copy_template(drive_service, template_id: str, new_title: str) -> dict:
         logger.error(f"Error copying template: {e}")
         raise
 
+@retry_with_backoff(max_attempts=3)
+def delete_file(drive_service, file_id: str) -> None:
+    """Delete a Drive file (used to clean up after cancelled jobs)"""
+    try:
+        drive_service.files().delete(fileId=file_id, supportsAllDrives=True).execute()
+        logger.info(f"Deleted Drive file {file_id}")
+    except HttpError as e:
+        if e.resp.status == 404:
+            return
+        logger.error(f"Error deleting file {file_id}: {e}")
+        raise
+
+def _element_text(element: dict) -> str:
+    """Concatenate the text of a page element, including table cells and grouped elements"""
+    parts = []
+    text_blocks = []
+    if 'shape' in element:
+        text_blocks.append(element['shape'].get('text', {}))
+    for row in element.get('table', {}).get('tableRows', []):
+        for cell in row.get('tableCells', []):
+            text_blocks.append(cell.get('text', {}))
+    for block in text_blocks:
+        for text_element in block.get('textElements', []):
+            parts.append(text_element.get('textRun', {}).get('content', ''))
+    for child in element.get('elementGroup', {}).get('children', []):
+        parts.append(_element_text(child))
+    return ''.join(parts)
+
+def build_placeholder_index(presentation: dict) -> dict:
+    """Map each slide's objectId to the set of placeholder tokens that appear on it"""
+    index = {}
+    for slide in presentation.get('slides', []):
+        tokens = set()
+        for element in slide.get('pageElements', []):
+            tokens.update(PLACEHOLDER_PATTERN.findall(_element_text(element)))
+        index[slide['objectId']] = tokens
+    return index
+
+def replace_text_request(token: str, value, page_object_ids: list = None) -> dict:
+    """Build a replaceAllText request, optionally scoped to specific pages"""
+    req = {
+        'replaceAllText': {
+            'containsText': {
+                'text': token,
+                'matchCase': True
+            },
+            'replaceText': str(value)
+        }
+    }
+    if page_object_ids:
+        req['replaceAllText']['pageObjectIds'] = page_object_ids
+    return req
+
 @retry_with_backoff()
-def replace_all_text(slides_service, presentation_id: str, replacements: dict) -> dict:
-    """Replace placeholder text in presentation"""
-    if not replacements:
+def get_presentation(slides_service, presentation_id: str) -> dict:
+    """Fetch a presentation's full structure"""
+    try:
+        return slides_service.presentations().get(presentationId=presentation_id).execute()
+    except HttpError as e:
+        logger.error(f"Error fetching presentation {presentation_id}: {e}")
+        raise
+
+@retry_with_backoff()
+def batch_update(slides_service, presentation_id: str, requests: list) -> dict:
+    """Apply a list of Slides API requests in a single batchUpdate"""
+    if not requests:
         return {}
-    
-    requests = []
-    for token, value in replacements.items():
-        requests.append({
-            'replaceAllText': {
-                'containsText': {
-                    'text': token,
-                    'matchCase': True
-                },
-                'replaceText': str(value)
-            }
-        })
-    
-    if requests:
-        try:
-            body = {'requests': requests}
-            result = slides_service.presentations().batchUpdate(
-                presentationId=presentation_id,
-                body=body
-            ).execute()
-            logger.info(f"Replaced {len(requests)} text placeholders")
-            return result
-        except HttpError as e:
-            logger.error(f"Error replacing text: {e}")
-            raise
-    return {}
+    try:
+        result = slides_service.presentations().batchUpdate(
+            presentationId=presentation_id,
+            body={'requests': requests}
+        ).execute()
+        logger.info(f"Applied {len(requests)} requests to presentation {presentation_id}")
+        return result
+    except HttpError as e:
+        logger.error(f"Error applying batch update: {e}")
+        raise
 
 @retry_with_backoff()
 def create_sheet_with_data(sheets_service, title: str, data: list) -> str:
@@ -2,7 +2,7 @@ import os
 import logging
 from fastapi import FastAPI, HTTPException, BackgroundTasks
 from pydantic import BaseModel
-from renderer import process_job
+from renderer import process_job, cancel_job, service_pool
 from supabase_client import SupabaseClient
 
 # Configure logging
@@ -28,6 +28,22 @@ if not SUPABASE_URL or not SUPABASE_KEY:
 supabase = SupabaseClient(SUPABASE_URL, SUPABASE_KEY)
 logger.info("Supabase client initialized")
 
+@app.on_event("startup")
+def check_template_access():
+    """Verify every pooled service account can read the default template"""
+    template_id = os.environ.get("DEFAULT_TEMPLATE_DRIVE_ID")
+    if not service_pool or not template_id:
+        return
+    results = service_pool.check_template_access(template_id)
+    missing = [email for email, ok in results.items() if ok is False]
+    unknown = [email for email, ok in results.items() if ok is None]
+    if missing:
+        logger.warning(f"Template {template_id} not shared with: {', '.join(missing)}")
+    if unknown:
+        logger.warning(f"Template access for {template_id} could not be checked for: {', '.join(unknown)}")
+    if not missing and not unknown:
+        logger.info(f"Template {template_id} accessible by all {len(results)} service accounts")
+
 class JobRequest(BaseModel):
     job_id: str
     template_drive_id: str = None
@@ -47,7 +63,7 @@ async def run_job(req: JobRequest, background_tasks: BackgroundTasks):
         raise HTTPException(status_code=404, detail="Job not found")
     
     # Check if already processing or done
-    if job.get('status') in ['processing', 'done']:
+    if job.get('status') in ['processing', 'done', 'cancelled']:
         logger.warning(f"Job {req.job_id} already in status: {job.get('status')}")
         return {
             "status": job.get('status'),
@@ -65,12 +81,51 @@ async def run_job(req: JobRequest, background_tasks: BackgroundTasks):
         "message": "Job processing started"
     }
 
+@app.post("/jobs/{job_id}/cancel")
+async def cancel(job_id: str):
+    """
+    Cancel a slide job.
+    In-flight work stops at its next checkpoint and partially created Drive files are removed.
+    """
+    logger.info(f"Received cancel request: {job_id}")
+    
+    job = supabase.get_slide_job(job_id)
+    if not job:
+        logger.error(f"Job not found: {job_id}")
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    if job.get('status') in ['done', 'failed', 'cancelled']:
+        return {
+            "status": job.get('status'),
+            "job_id": job_id,
+            "message": f"Job is already {job.get('status')}"
+        }
+    
+    # Only cancel jobs that have not finished meanwhile
+    if not supabase.update_slide_job(job_id, {"status": "cancelled"}, exclude_statuses=["done", "failed"]):
+        status = supabase.get_slide_job_status(job_id)
+        return {
+            "status": status,
+            "job_id": job_id,
+            "message": f"Job is already {status}"
+        }
+    
+    # Signal the worker if the job runs here; other replicas pick up the status at their next checkpoint
+    running_here = cancel_job(job_id)
+    
+    return {
+        "status": "cancelled",
+        "job_id": job_id,
+        "message": "Job cancelled" if running_here else "Job marked as cancelled"
+    }
+
 @app.get("/health")
 async def health():
     """Health check endpoint"""
     return {
         "status": "ok",
-        "service": "level6-renderer"
+        "service": "level6-renderer",
+        "identities": service_pool.stats() if service_pool else []
     }
 
 @app.get("/")
@@ -81,7 +136,8 @@ async def root():
         "version": "1.0.0",
         "endpoints": {
             "health": "/health",
-            "run_job": "/run-job"
+            "run_job": "/run-job",
+            "cancel_job": "/jobs/{job_id}/cancel"
         }
     }
 
@@ -1,23 +1,26 @@
 import os
 import json
 import time
+import uuid
 import logging
+import threading
 from gdrive_helpers import (
-    get_services, copy_template, replace_all_text,
+    get_service_pool, copy_template, delete_file, batch_update, get_presentation,
+    build_placeholder_index, replace_text_request,
     create_sheet_with_data, add_chart_to_sheet,
     insert_sheets_chart, insert_image, export_presentation_as_pptx
 )
 from supabase_client import SupabaseClient
-from utils import inches_to_emu
+from utils import inches_to_emu, Deadline, JobInterrupted, JobCancelled
 
 logger = logging.getLogger(__name__)
 
-# Initialize services
+# Initialize service account pool
 try:
-    slides_service, drive_service, sheets_service = get_services()
+    service_pool = get_service_pool()
 except Exception as e:
     logger.error(f"Failed to initialize Google services: {e}")
-    slides_service = drive_service = sheets_service = None
+    service_pool = None
 
 # Initialize Supabase
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
@@ -27,7 +30,34 @@ if not SUPABASE_URL or not SUPABASE_KEY:
 
 supabase = SupabaseClient(SUPABASE_URL, SUPABASE_KEY)
 
-def process_job(job_id: str, template_drive_id: str = None):
+# Time budget for a single job, in seconds
+JOB_DEADLINE_SECONDS = float(os.environ.get("JOB_DEADLINE_SECONDS", 600))
+
+# Time budget for removing Drive files after a job is interrupted, in seconds
+CLEANUP_DEADLINE_SECONDS = 10
+
+# Deadlines of jobs in flight on this worker, keyed by job ID
+_active_jobs = {}
+_active_jobs_lock = threading.Lock()
+
+def cancel_job(job_id: str) -> bool:
+    """Signal an in-flight job on this worker to stop. Returns False if it is not running here."""
+    with _active_jobs_lock:
+        deadline = _active_jobs.get(job_id)
+    if not deadline:
+        return False
+    deadline.cancel()
+    logger.info(f"Cancellation requested for job {job_id}")
+    return True
+
+def _checkpoint(job_id: str, deadline: Deadline):
+    """Stop if the budget is spent or the job was cancelled (possibly from another replica)"""
+    deadline.check()
+    if supabase.get_slide_job_status(job_id, deadline=deadline) == 'cancelled':
+        deadline.cancel()
+        deadline.check()
+
+def process_job(job_id: str, template_drive_id: str = None, deadline: Deadline = None):
     """
     Process a slide job:
     1. Fetch job from Supabase
@@ -37,16 +67,45 @@ def process_job(job_id: str, template_drive_id: str = None):
     5. Export as PPTX
     6. Upload to Supabase Storage
     7. Update job status
+    
+    The job stops cooperatively once its deadline passes or cancel_job() is called.
     """
+    deadline = deadline or Deadline(JOB_DEADLINE_SECONDS)
+    with _active_jobs_lock:
+        _active_jobs[job_id] = deadline
+    try:
+        return _process_job(job_id, template_drive_id, deadline)
+    except JobCancelled:
+        logger.info(f"Job {job_id} cancelled")
+        supabase.update_slide_job(job_id, {"status": "cancelled"}, exclude_statuses=["done", "failed"])
+        return None
+    except JobInterrupted as e:
+        logger.error(f"Job {job_id} stopped: {e}")
+        supabase.update_slide_job(job_id, {
+            "status": "failed",
+            "error_message": str(e)
+        }, exclude_statuses=["cancelled"])
+        return None
+    finally:
+        with _active_jobs_lock:
+            _active_jobs.pop(job_id, None)
+
+def _process_job(job_id: str, template_drive_id: str, deadline: Deadline):
     logger.info(f"Processing job {job_id}")
     
     # Fetch job
-    job = supabase.get_slide_job(job_id)
+    job = supabase.get_slide_job(job_id, deadline=deadline)
     if not job:
         raise RuntimeError(f"Job not found: {job_id}")
     
-    # Update status to processing
-    supabase.update_slide_job(job_id, {"status": "processing"})
+    if job.get('status') == 'cancelled':
+        raise JobCancelled(f"Job {job_id} was cancelled before it started")
+    
+    # Update status to processing, unless a cancel landed since the read above
+    if not supabase.update_slide_job(job_id, {"status": "processing"}, deadline=deadline,
+                                     exclude_statuses=["cancelled"]):
+        if supabase.get_slide_job_status(job_id, deadline=deadline) == 'cancelled':
+            raise JobCancelled(f"Job {job_id} was cancelled before it started")
     
     # Get slide plan
     slide_plan = job.get("slide_plan") or job.get("ppt_plan") or {}
@@ -58,7 +117,7 @@ def process_job(job_id: str, template_drive_id: str = None):
             supabase.update_slide_job(job_id, {
                 "status": "failed",
                 "error_message": "Invalid slide_plan JSON"
-            })
+            }, exclude_statuses=["cancelled"])
             return None
     
     if not slide_plan or not slide_plan.get("slides"):
@@ -66,7 +125,7 @@ def process_job(job_id: str, template_drive_id: str = None):
         supabase.update_slide_job(job_id, {
             "status": "failed",
             "error_message": "No slides in plan"
-        })
+        }, exclude_statuses=["cancelled"])
         return None
     
     # Get template ID
@@ -81,43 +140,148 @@ def process_job(job_id: str, template_drive_id: str = None):
         supabase.update_slide_job(job_id, {
             "status": "failed",
             "error_message": "No template specified"
-        })
+        }, exclude_statuses=["cancelled"])
+        return None
+    
+    if not service_pool:
+        logger.error(f"Google services unavailable for job {job_id}")
+        supabase.update_slide_job(job_id, {
+            "status": "failed",
+            "error_message": "Google services not initialized"
+        }, exclude_statuses=["cancelled"])
         return None
     
+    with service_pool.lease(job_id, template_id) as identity:
+        slides_service, drive_service, sheets_service = identity.services()
+        return _render(job_id, slide_plan, template_id, deadline,
+                       slides_service, drive_service, sheets_service)
+
+def _cleanup_files(drive_service, file_ids: list):
+    """Best-effort removal of Drive files created by an interrupted job"""
+    cleanup_deadline = Deadline(CLEANUP_DEADLINE_SECONDS)
+    for file_id in file_ids:
+        try:
+            delete_file(drive_service, file_id, deadline=cleanup_deadline)
+        except Exception as e:
+            logger.error(f"Failed to clean up Drive file {file_id}: {e}")
+
+def _build_page_requests(slides: list, page_ids: list, placeholder_index: dict) -> tuple:
+    """
+    Resolve each slide config to a page and build a single batch of requests.
+    Configs with layout_slide_index get a fresh duplicate of that template slide;
+    configs with target_slide_index edit the template slide in place.
+    Placeholders are first replaced on their own page when the index shows the token there
+    (the last value wins when several configs share a page). Remaining occurrences on original
+    template slides are then filled deck-wide with each token's last value; leftover tokens on
+    duplicates are blanked so one copy never shows another copy's content.
+    In layout mode every original slide that no config targets is removed.
+    Returns (page objectId per slide config, requests).
+    """
+    duplicate_requests = []
+    scoped = {}
+    deck_wide = {}
+    slide_pages = []
+    duplicates = {}
+    
+    for n, slide_config in enumerate(slides):
+        if 'layout_slide_index' in slide_config:
+            source_id = page_ids[min(slide_config['layout_slide_index'], len(page_ids) - 1)]
+            page_id = f"slide_{n}_{uuid.uuid4().hex[:12]}"
+            duplicate_requests.append({
+                'duplicateObject': {
+                    'objectId': source_id,
+                    'objectIds': {source_id: page_id}
+                }
+            })
+            duplicates[page_id] = source_id
+        else:
+            source_id = page_ids[min(slide_config.get('target_slide_index', 0), len(page_ids) - 1)]
+            page_id = source_id
+        slide_pages.append(page_id)
+        
+        for token, value in slide_config.get('placeholders', {}).items():
+            if token in placeholder_index.get(source_id, ()):
+                scoped[(page_id, token)] = value
+            deck_wide[token] = value
+    
+    # Duplicates must exist before any replacement touches their source slide
+    requests = list(duplicate_requests)
+    for (page_id, token), value in scoped.items():
+        requests.append(replace_text_request(token, value, [page_id]))
+    
+    if not duplicates:
+        # Page-scoped values already ran; fill the rest of the deck as before page scoping
+        for token, value in deck_wide.items():
+            requests.append(replace_text_request(token, value))
+        return slide_pages, requests
+    
+    # Layout mode: only originals that a config targets survive
+    kept_originals = [p for p in dict.fromkeys(slide_pages) if p not in duplicates]
+    if kept_originals:
+        for token, value in deck_wide.items():
+            requests.append(replace_text_request(token, value, kept_originals))
+    
+    # Blank placeholders the plan did not fill on each copy
+    unfilled = {}
+    for page_id, source_id in duplicates.items():
+        for token in sorted(placeholder_index.get(source_id, ())):
+            if (page_id, token) not in scoped:
+                unfilled.setdefault(token, []).append(page_id)
+    for token, pages in unfilled.items():
+        requests.append(replace_text_request(token, '', pages))
+    
+    # Put planned slides in plan order and drop every other original slide
+    for position, page_id in enumerate(dict.fromkeys(slide_pages)):
+        requests.append({
+            'updateSlidesPosition': {
+                'slideObjectIds': [page_id],
+                'insertionIndex': position
+            }
+        })
+    for page_id in page_ids:
+        if page_id not in slide_pages:
+            requests.append({'deleteObject': {'objectId': page_id}})
+    
+    return slide_pages, requests
+
+def _render(job_id: str, slide_plan: dict, template_id: str, deadline: Deadline,
+            slides_service, drive_service, sheets_service):
+    """Render the slide plan with one identity's clients and upload the PPTX"""
+    created_files = []
     try:
         # Copy template
         new_title = f"ppt_job_{job_id}_{int(time.time())}"
-        new_presentation = copy_template(drive_service, template_id, new_title)
+        new_presentation = copy_template(drive_service, template_id, new_title, deadline=deadline)
         presentation_id = new_presentation['id']
+        created_files.append(presentation_id)
         logger.info(f"Created presentation {presentation_id}")
         
+        _checkpoint(job_id, deadline)
+        
         # Get slide metadata
-        slides_metadata = slides_service.presentations().get(
-            presentationId=presentation_id
-        ).execute()
+        slides_metadata = get_presentation(slides_service, presentation_id, deadline=deadline)
         page_ids = [s['objectId'] for s in slides_metadata.get('slides', [])]
         
         if not page_ids:
             raise RuntimeError("Template has no slides")
         
-        # Collect all replacements
-        all_replacements = {}
-        for slide_config in slide_plan.get("slides", []):
-            placeholders = slide_config.get("placeholders", {})
-            all_replacements.update(placeholders)
+        # Index where each placeholder token appears per template slide
+        placeholder_index = build_placeholder_index(slides_metadata)
         
-        # Replace text placeholders
-        if all_replacements:
-            replace_all_text(slides_service, presentation_id, all_replacements)
-            logger.info(f"Replaced {len(all_replacements)} placeholders")
+        # Duplicate layouts and fill placeholders in one batch
+        slides = slide_plan.get("slides", [])
+        slide_pages, page_requests = _build_page_requests(slides, page_ids, placeholder_index)
+        if page_requests:
+            batch_update(slides_service, presentation_id, page_requests, deadline=deadline)
+            logger.info(f"Prepared {len(slide_pages)} slides with {len(page_requests)} requests")
         
         # Process each slide configuration
-        for slide_config in slide_plan.get("slides", []):
-            slide_index = min(
-                slide_config.get('target_slide_index', 0),
-                len(page_ids) - 1
-            )
-            page_object_id = page_ids[slide_index]
+        for slide_index, (slide_config, page_object_id) in enumerate(zip(slides, slide_pages)):
+            # Only poll Supabase for remote cancels before slides that make Google calls
+            if 'chart_spec' in slide_config or 'image' in slide_config:
+                _checkpoint(job_id, deadline)
+            else:
+                deadline.check()
             
             # Insert chart if specified
             if 'chart_spec' in slide_config:
@@ -128,13 +292,15 @@ def process_job(job_id: str, template_drive_id: str = None):
                     spreadsheet_id = create_sheet_with_data(
                         sheets_service,
                         sheet_title,
-                        chart_spec['data']
+                        chart_spec['data'],
+                        deadline=deadline
                     )
+                    created_files.append(spreadsheet_id)
                     
                     # Add chart to sheet
                     row_count = len(chart_spec['data'])
                     chart_spec['rowCount'] = row_count
-                    chart_id = add_chart_to_sheet(sheets_service, spreadsheet_id, chart_spec)
+                    chart_id = add_chart_to_sheet(sheets_service, spreadsheet_id, chart_spec, deadline=deadline)
                     
                     # Insert chart into slide
                     emu = {
@@ -149,9 +315,12 @@ def process_job(job_id: str, template_drive_id: str = None):
                         page_object_id,
                         spreadsheet_id,
                         chart_id,
-                        emu
+                        emu,
+                        deadline=deadline
                     )
                     logger.info(f"Inserted chart into slide {slide_index}")
+                except JobInterrupted:
+                    raise
                 except Exception as e:
                     logger.error(f"Error inserting chart: {e}")
                     # Continue with other slides
@@ -182,36 +351,45 @@ def process_job(job_id: str, template_drive_id: str = None):
                             presentation_id,
                             page_object_id,
                             image_url,
-                            emu
+                            emu,
+                            deadline=deadline
                         )
                         logger.info(f"Inserted image into slide {slide_index}")
+                except JobInterrupted:
+                    raise
                 except Exception as e:
                     logger.error(f"Error inserting image: {e}")
                     # Continue with other slides
         
         # Export as PPTX
-        pptx_bytes = export_presentation_as_pptx(drive_service, presentation_id)
+        _checkpoint(job_id, deadline)
+        pptx_bytes = export_presentation_as_pptx(drive_service, presentation_id, deadline=deadline)
         
         # Upload to Supabase Storage
-        public_url = supabase.upload_ppt_bytes(job_id, pptx_bytes)
+        public_url = supabase.upload_ppt_bytes(job_id, pptx_bytes, deadline=deadline)
         
         if not public_url:
             raise RuntimeError("Failed to upload PPTX to storage")
         
-        # Update job status
-        supabase.update_slide_job(job_id, {
+        # Update job status, unless it was cancelled after the last checkpoint
+        if not supabase.update_slide_job(job_id, {
             "status": "done",
             "final_ppt_url": public_url
-        })
+        }, exclude_statuses=["cancelled"]):
+            if supabase.get_slide_job_status(job_id) == 'cancelled':
+                raise JobCancelled(f"Job {job_id} was cancelled before completion")
         
         logger.info(f"Job {job_id} completed successfully: {public_url}")
         return public_url
         
+    except JobInterrupted:
+        _cleanup_files(drive_service, created_files)
+        raise
     except Exception as e:
         logger.error(f"Error processing job {job_id}: {e}", exc_info=True)
         supabase.update_slide_job(job_id, {
             "status": "failed",
             "error_message": str(e)
-        })
+        }, exclude_statuses=["cancelled"])
         raise
 
@@ -2,6 +2,7 @@ import os
 import logging
 from supabase import create_client, Client
 from typing import Optional, Dict, Any
+from utils import Deadline
 
 logger = logging.getLogger(__name__)
 
@@ -16,8 +17,10 @@ class SupabaseClient:
             logger.error(f"Failed to create Supabase client: {e}")
             raise
 
-    def get_slide_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+    def get_slide_job(self, job_id: str, deadline: Deadline = None) -> Optional[Dict[str, Any]]:
         """Fetch a slide job by ID"""
+        if deadline:
+            deadline.check()
         try:
             response = self.client.table("slide_jobs").select("*").eq("id", job_id).single().execute()
             if hasattr(response, 'data') and response.data:
@@ -27,21 +30,50 @@ class SupabaseClient:
             logger.error(f"Error fetching slide job {job_id}: {e}")
             return None
 
-    def update_slide_job(self, job_id: str, payload: dict) -> bool:
-        """Update a slide job"""
+    def get_slide_job_status(self, job_id: str, deadline: Deadline = None) -> Optional[str]:
+        """Fetch only the status of a slide job"""
+        if deadline:
+            deadline.check()
         try:
-            response = self.client.table("slide_jobs").update(payload).eq("id", job_id).execute()
+            response = self.client.table("slide_jobs").select("status").eq("id", job_id).single().execute()
+            if hasattr(response, 'data') and response.data:
+                return response.data.get("status")
+            return None
+        except Exception as e:
+            logger.error(f"Error fetching status of slide job {job_id}: {e}")
+            return None
+
+    def update_slide_job(self, job_id: str, payload: dict, deadline: Deadline = None,
+                         exclude_statuses: list = None) -> bool:
+        """
+        Update a slide job.
+        With exclude_statuses, the row is only updated if its current status is not one of them;
+        returns False when no row was updated.
+        """
+        if deadline:
+            deadline.check()
+        try:
+            query = self.client.table("slide_jobs").update(payload).eq("id", job_id)
+            for status in exclude_statuses or []:
+                query = query.neq("status", status)
+            response = query.execute()
+            if exclude_statuses and not response.data:
+                logger.info(f"Job {job_id} not updated, status is one of {exclude_statuses}")
+                return False
             logger.info(f"Updated job {job_id}: {payload}")
             return True
         except Exception as e:
             logger.error(f"Error updating slide job {job_id}: {e}")
             return False
 
-    def upload_ppt_bytes(self, job_id: str, data: bytes, bucket: str = None, filename: str = None) -> Optional[str]:
+    def upload_ppt_bytes(self, job_id: str, data: bytes, bucket: str = None, filename: str = None,
+                         deadline: Deadline = None) -> Optional[str]:
         """
         Upload PPTX bytes to Supabase Storage
         Returns the public URL if successful
         """
+        if deadline:
+            deadline.check()
         if not bucket:
             bucket = os.environ.get("SUPABASE_PPT_BUCKET", "ppt-results")
         if not filename:
@@ -1,22 +1,74 @@
 import time
 import random
 import logging
+import threading
 from functools import wraps
 
 logger = logging.getLogger(__name__)
 
+class JobInterrupted(Exception):
+    """Base class for a job stopped before completion"""
+
+class JobCancelled(JobInterrupted):
+    """The job was cancelled"""
+
+class DeadlineExceeded(JobInterrupted):
+    """The job ran out of its time budget"""
+
+class Deadline:
+    """
+    Per-job time budget with cooperative cancellation.
+    Pass it to helpers as deadline=...; they check it between steps and cap retries by the time left.
+    """
+    def __init__(self, seconds: float = None):
+        self.expires_at = time.monotonic() + seconds if seconds else None
+        self._cancelled = threading.Event()
+
+    def remaining(self) -> float:
+        """Seconds left in the budget (inf if unbounded)"""
+        if self.expires_at is None:
+            return float('inf')
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def check(self):
+        """Raise if the job was cancelled or its budget is spent"""
+        if self.cancelled:
+            raise JobCancelled("Job was cancelled")
+        if self.remaining() <= 0:
+            raise DeadlineExceeded("Job deadline exceeded")
+
+    def sleep(self, seconds: float):
+        """Sleep up to the given time, waking early on cancellation"""
+        self._cancelled.wait(min(seconds, self.remaining()))
+        self.check()
+
+# Minimum time that must remain in a job budget for a retry to be worthwhile, in seconds
+RETRY_MARGIN_SECONDS = 0.5
+
 def retry_with_backoff(max_attempts=5, base_delay=0.5, max_delay=60):
     """
-    Decorator for retrying functions with exponential backoff
+    Decorator for retrying functions with exponential backoff.
+    Callers may pass deadline=Deadline(...) to bound retries by the job's remaining time.
     """
     def decorator(fn):
         @wraps(fn)
-        def inner(*args, **kwargs):
+        def inner(*args, deadline: Deadline = None, **kwargs):
             attempt = 0
             last_exception = None
             while attempt < max_attempts:
+                if deadline:
+                    deadline.check()
                 try:
                     return fn(*args, **kwargs)
+                except JobInterrupted:
+                    raise
                 except Exception as e:
                     last_exception = e
                     attempt += 1
@@ -26,8 +78,18 @@ def retry_with_backoff(max_attempts=5, base_delay=0.5, max_delay=60):
                     
                     # Calculate sleep time with exponential backoff
                     sleep = min(max_delay, base_delay * (2 ** (attempt - 1)) + random.random())
-                    logger.warning(f"Function {fn.__name__} failed (attempt {attempt}/{max_attempts}), retrying in {sleep:.2f}s: {e}")
-                    time.sleep(sleep)
+                    if deadline:
+                        # Cap the backoff by the budget, keeping a margin for the retry itself
+                        usable = deadline.remaining() - RETRY_MARGIN_SECONDS
+                        if usable <= 0:
+                            logger.error(f"Function {fn.__name__} failed with {deadline.remaining():.2f}s left in job budget, not retrying: {e}")
+                            raise DeadlineExceeded(f"Job deadline exceeded during {fn.__name__}: {e}") from e
+                        sleep = min(sleep, usable)
+                        logger.warning(f"Function {fn.__name__} failed (attempt {attempt}/{max_attempts}), retrying in {sleep:.2f}s: {e}")
+                        deadline.sleep(sleep)
+                    else:
+                        logger.warning(f"Function {fn.__name__} failed (attempt {attempt}/{max_attempts}), retrying in {sleep:.2f}s: {e}")
+                        time.sleep(sleep)
             
             # Should never reach here, but just in case
             if last_exception:
@@ -28,7 +28,7 @@ export default function ReportView() {
   // Level-6 integration state
   const [useLevel6, setUseLevel6] = useState(false)
   const [level6JobId, setLevel6JobId] = useState(null)
-  const [level6JobStatus, setLevel6JobStatus] = useState(null) // 'pending', 'processing', 'done', 'failed'
+  const [level6JobStatus, setLevel6JobStatus] = useState(null) // 'pending', 'processing', 'done', 'failed', 'cancelled'
   const [level6PptUrl, setLevel6PptUrl] = useState(null)
   const [level6Error, setLevel6Error] = useState(null)
   const [universalFramework, setUniversalFramework] = useState(null)
@@ -679,6 +679,10 @@ export default function ReportView() {
         setLevel6Error(data.error_message || 'Job failed')
         setIsGeneratingSlides(false)
         return true // Job failed
+      } else if (data.status === 'cancelled') {
+        setLevel6Error(null)
+        setIsGeneratingSlides(false)
+        return true // Job cancelled
       } else if (data.status === 'processing') {
         // Continue polling
         setTimeout(() => pollLevel6Job(jobId), 2000)
@@ -3586,6 +3590,7 @@ ${report.conclusion || ''}
             <div className={`mb-6 rounded-xl p-4 border-2 ${
               level6JobStatus === 'done' ? 'bg-green-50 border-green-300' :
               level6JobStatus === 'failed' ? 'bg-red-50 border-red-300' :
+              level6JobStatus === 'cancelled' ? 'bg-gray-50 border-gray-300' :
               level6JobStatus === 'processing' ? 'bg-gray-50 border-black' :
               'bg-yellow-50 border-yellow-300'
             }`}>
@@ -3594,6 +3599,8 @@ ${report.conclusion || ''}
                   <Check className="w-5 h-5 text-green-600" />
                 ) : level6JobStatus === 'failed' ? (
                   <AlertCircle className="w-5 h-5 text-red-600" />
+                ) : level6JobStatus === 'cancelled' ? (
+                  <AlertCircle className="w-5 h-5 text-gray-500" />
                 ) : (
                   <Loader2 className="w-5 h-5 text-black animate-spin" />
                 )}
@@ -3601,12 +3608,14 @@ ${report.conclusion || ''}
                   <h4 className="font-semibold text-gray-900">
                     {level6JobStatus === 'done' ? 'Level-6 PPT Ready!' :
                      level6JobStatus === 'failed' ? 'Level-6 Processing Failed' :
+                     level6JobStatus === 'cancelled' ? 'Level-6 Job Cancelled' :
                      level6JobStatus === 'processing' ? 'Processing with Level-6...' :
                      'Level-6 Job Created'}
                   </h4>
                   <p className="text-sm text-gray-600 mt-1">
                     {level6JobStatus === 'done' ? 'Your high-quality PPTX is ready for download' :
                      level6JobStatus === 'failed' ? (level6Error || 'An error occurred during processing') :
+                     level6JobStatus === 'cancelled' ? 'The job was cancelled before it finished' :
                      level6JobStatus === 'processing' ? 'Rendering with Google Slides API...' :
                      'Job queued, waiting for processing...'}
                   </p>
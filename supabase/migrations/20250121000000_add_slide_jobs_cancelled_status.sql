@@ -0,0 +1,5 @@
+-- Allow slide jobs to be cancelled via the Level-6 renderer
+ALTER TABLE slide_jobs DROP CONSTRAINT IF EXISTS slide_jobs_status_check;
+ALTER TABLE slide_jobs
+  ADD CONSTRAINT slide_jobs_status_check
+  CHECK (status IN ('pending', 'processing', 'done', 'failed', 'cancelled'));